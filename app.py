@@ -1,8 +1,14 @@
+import os
 import sys
-from typing import List, Optional
+import tempfile
+import threading
+import contextvars
+from contextlib import ExitStack, nullcontext
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 import xarray as xr
-from concurrent.futures import ThreadPoolExecutor
+import dask.array as da
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 import asyncio
 from arkitekt import register, group
 from mikro.api.schema import (
@@ -24,32 +30,451 @@ from mikro.api.schema import (
     create_channel,
     Dimension,
     EraFragment,
+    InstrumentFragment,
+    PositionFragment,
+    TimepointFragment,
 )
-from ome_types.model import Pixels
+from ome_types import from_xml
+from ome_types.model import OME, Image, Pixels
 import logging
 import tifffile
-from aicsimageio.metadata.utils import bioformats_ome
+from aicsimageio.metadata.utils import clean_ome_xml_for_known_issues
 from scyjava import config, jimport
 import scyjava
-from aicsimageio import AICSImage
+from bioformats_jar import get_loci
+import jpype
 logger = logging.getLogger(__name__)
 x = config
 
+# starting the JVM and loading bioformats takes seconds, so do it once when
+# the app is loaded instead of within the first conversion
+loci = get_loci()
 
-def load_as_xarray(path: str, index: int):
-    if path.endswith((".stk", ".tif", ".tiff", ".TIF")):
-        image = tifffile.imread(path)
-        print(image.shape)
+# bioformats allocates a 1 MiB buffer for every file handle it opens, which
+# dominates reader initialization on network shares; a small one is enough
+loci.common.NIOFileHandle.setDefaultBufferSize(8192)
 
-        image = image.reshape((1,) * (5 - image.ndim) + image.shape)
+# number of threads used to read planes of a single series concurrently
+READ_WORKERS = 4
+
+# number of series of a file that are converted concurrently
+SERIES_WORKERS = 4
+
+# bioformats readers that take longer than this (in ms) to initialize are
+# memoized to disk, so reopening the same file skips the initialization
+MEMOIZE_MS = 1000
+
+# directory the memos are written to, instead of next to the (possibly read
+# only or remote) input file
+MEMO_DIR = os.path.join(tempfile.gettempdir(), "omero-bfmemo")
+os.makedirs(MEMO_DIR, exist_ok=True)
+
+TIFF_SUFFIXES = (".stk", ".tif", ".tiff", ".TIF")
+
+# numpy dtypes of the OME pixel types
+PIXEL_TYPES = {
+    "int8": np.int8,
+    "int16": np.int16,
+    "int32": np.int32,
+    "uint8": np.uint8,
+    "uint16": np.uint16,
+    "uint32": np.uint32,
+    "float": np.float32,
+    "double": np.float64,
+}
+
+
+# ctzyx dimensions of the axes tifffile reports for a series, all other axes
+# (e.g. I or Q for generic image sequences) are treated as stacks along z
+TIFF_AXES = {"S": "c", "C": "c", "T": "t", "Y": "y", "X": "x"}
+
+
+def is_tiff(path: str) -> bool:
+    return path.endswith(TIFF_SUFFIXES)
+
+
+def open_tiff(path: str) -> tifffile.TiffFile:
+    # we only ever convert the uploaded file itself, so skip the scan for
+    # companion files of multi-file datasets
+    return tifffile.TiffFile(path, _multifile=False)
+
+
+def tiff_as_ctzyx(
+    series: tifffile.TiffPageSeries, chunkmode: int = tifffile.CHUNKMODE.PAGE
+) -> da.Array:
+    """Lazily reads a tiff series as a ctzyx array
+
+    Axes that map onto the same dimension (e.g. C and S) are merged and
+    missing dimensions are added with size 1.
+    """
+    # open the series as a zarr store, so pixels are only decoded chunk by
+    # chunk while from_xarray uploads them. Chunks are whole pages (planes)
+    # by default, as tiff strips would make for one tiny dask task per row
+    image = da.from_zarr(series.aszarr(level=0, chunkmode=chunkmode))
+    groups = {dim: [] for dim in "ctzyx"}
+    for i, axis in enumerate(series.axes):
+        groups[TIFF_AXES.get(axis, "z")].append(i)
+
+    order = [i for dim in "ctzyx" for i in groups[dim]]
+    shape = tuple(
+        int(np.prod([image.shape[i] for i in groups[dim]])) for dim in "ctzyx"
+    )
+    return image.transpose(order).reshape(shape)
+
+
+def check_region(region: Tuple[int, int, int, int], size_x: int, size_y: int):
+    x, y, width, height = region
+    assert (
+        x >= 0 and y >= 0 and width > 0 and height > 0
+    ), f"Invalid region {region}"
+    assert (
+        x + width <= size_x and y + height <= size_y
+    ), f"Region {region} exceeds the planes of size {size_x}x{size_y}"
+
+
+def pixels_dtype(pixels: Pixels) -> Optional[np.dtype]:
+    return PIXEL_TYPES.get(pixels.type.value) if pixels.type else None
+
+
+def open_reader(path: str, index: int = 0):
+    """Opens a memoized bioformats reader on the series index of path
+
+    All readers are configured the same way (including the OME metadata
+    store), so the memo written by the first one is reused by every later
+    reader of the same file.
+    """
+    reader = loci.formats.Memoizer(
+        loci.formats.ImageReader(), MEMOIZE_MS, jimport("java.io.File")(MEMO_DIR)
+    )
+    reader.setMetadataStore(loci.formats.MetadataTools.createOMEXMLMetadata())
+    reader.setId(path)
+    reader.setSeries(index)
+    return reader
+
+
+def reader_ome(reader) -> OME:
+    """Parses the OME metadata collected by an opened bioformats reader"""
+    # bioformats writes some known schema violations, which aicsimageio
+    # (and therefore bioformats_ome) cleans up before parsing
+    xml = str(reader.getMetadataStore().dumpXML())
+    return from_xml(clean_ome_xml_for_known_issues(xml))
+
+
+def read_ome(path: str) -> OME:
+    """Reads the OME metadata of path through a (memoized) bioformats reader
+
+    Only meant for files whose pixels are not read through bioformats
+    (tiffs), otherwise use PlaneReader.ome to share its readers.
+    """
+    reader = open_reader(path)
+    try:
+        return reader_ome(reader)
+    finally:
+        reader.close()
+
+
+def reader_dtype(reader) -> np.dtype:
+    """The (byte ordered) dtype of the planes returned by reader"""
+    tools = loci.formats.FormatTools
+    pixel_type = reader.getPixelType()
+    if tools.isFloatingPoint(pixel_type):
+        kind = "f"
+    elif tools.isSigned(pixel_type):
+        kind = "i"
+    else:
+        kind = "u"
+    order = "<" if reader.isLittleEndian() else ">"
+    return np.dtype(f"{order}{kind}{tools.getBytesPerPixel(pixel_type)}")
+
+
+class PlaneReader:
+    """Reads the planes of a file with a fixed pool of bioformats readers
+
+    Bioformats readers are not thread safe, so every pool thread opens
+    the file once with its own reader and switches between series with
+    setSeries. The pool and its readers live as long as the PlaneReader,
+    so converting many series of a file does not initialize it again.
+    """
+
+    def __init__(self, path: str, max_workers: int = READ_WORKERS):
+        self.path = path
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._local = threading.local()
+
+    def _reader(self, index: int):
+        if not hasattr(self._local, "reader"):
+            self._local.reader = open_reader(self.path)
+        reader = self._local.reader
+        if reader.getSeries() != index:
+            reader.setSeries(index)
+        return reader
+
+    def _bytes(self, nbytes: int):
+        # reuse one java buffer per thread instead of a new one per plane,
+        # openBytes only fills the first nbytes of a larger buffer
+        buffer = getattr(self._local, "bytes", None)
+        if buffer is None or len(buffer) < nbytes:
+            buffer = self._local.bytes = jpype.JArray(jpype.JByte)(nbytes)
+        return buffer
+
+    def ome(self) -> OME:
+        """Reads the OME metadata with one of the pool's readers
+
+        The reader stays open for the pixel reads afterwards, so the
+        metadata does not cost another initialization of the file.
+        """
+        return self.pool.submit(lambda: reader_ome(self._reader(0))).result()
+
+    def read_series(
+        self,
+        index: int,
+        dtype: Optional[np.dtype] = None,
+        region: Optional[Tuple[int, int, int, int]] = None,
+        out: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """Reads the series index plane by plane into a ctzyx array
+
+        If a region (x, y, width, height) is given, only that tile of every
+        plane is decoded. If out is given, the planes are read into it
+        instead of a newly allocated array.
+        """
+
+        def describe():
+            reader = self._reader(index)
+            if region:
+                check_region(region, reader.getSizeX(), reader.getSizeY())
+            return (
+                (reader.getSizeC(), reader.getSizeT(), reader.getSizeZ()),
+                region or (0, 0, reader.getSizeX(), reader.getSizeY()),
+                reader_dtype(reader),
+                # rgb planes hold all their samples (channels) at once
+                reader.getRGBChannelCount(),
+                reader.isInterleaved(),
+                reader.getImageCount(),
+            )
+
+        (
+            (size_c, size_t, size_z),
+            (x, y, size_x, size_y),
+            plane_dtype,
+            samples,
+            interleaved,
+            image_count,
+        ) = self.pool.submit(describe).result()
+
+        shape = (size_c, size_t, size_z, size_y, size_x)
+        if out is not None:
+            assert out.shape == shape, f"Buffer {out.shape} does not fit series {shape}"
+            buf = out
+        else:
+            buf = np.empty(shape, dtype=dtype or plane_dtype.newbyteorder("="))
+        count = samples * size_y * size_x
+
+        def read_plane(no: int):
+            reader = self._reader(index)
+            raw = self._bytes(count * plane_dtype.itemsize)
+            z, c, t = reader.getZCTCoords(no)
+            reader.openBytes(no, raw, x, y, size_x, size_y)
+            plane = np.frombuffer(memoryview(raw), dtype=plane_dtype, count=count)
+            if samples == 1:
+                buf[c, t, z] = plane.reshape(size_y, size_x)
+            elif interleaved:
+                # split the samples into their channels in a single pass
+                buf[c * samples : (c + 1) * samples, t, z] = plane.reshape(
+                    size_y, size_x, samples
+                ).transpose(2, 0, 1)
+            else:
+                buf[c * samples : (c + 1) * samples, t, z] = plane.reshape(
+                    samples, size_y, size_x
+                )
+
+        # submit planes in the order they are stored in the file (its
+        # dimension order), so the reads advance through it sequentially
+        futures = [self.pool.submit(read_plane, no) for no in range(image_count)]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            # drop the queued planes of a failed series, and wait for the
+            # running ones, so nothing writes into buf after we return
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            raise
+
+        return buf
+
+    def close(self):
+        # close every reader and detach its thread from the JVM within the
+        # thread owning it; the barrier makes each thread take exactly one task
+        barrier = threading.Barrier(self.max_workers)
+
+        def release():
+            barrier.wait()
+            reader = self._local.__dict__.pop("reader", None)
+            # drop every java reference held by this thread first, otherwise
+            # releasing them at thread exit attaches the thread again
+            self._local.__dict__.pop("bytes", None)
+            try:
+                if reader is not None:
+                    reader.close()
+            finally:
+                del reader
+                jpype.JClass("java.lang.Thread").detach()
+
+        try:
+            futures = [self.pool.submit(release) for _ in range(self.max_workers)]
+            for future in futures:
+                future.result()
+        finally:
+            self.pool.shutdown()
+
+    def __enter__(self) -> "PlaneReader":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def scratch_array(
+    scratch: threading.local, shape: Tuple[int, ...], dtype: np.dtype
+) -> np.ndarray:
+    """A view of shape and dtype onto the scratch buffer of this thread
+
+    The buffer is reused by series of a similar size, and reallocated if
+    it is too small or more than twice as large as needed, so a thread
+    doesn't hold on to the memory of a large series while reading small ones.
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buffer = getattr(scratch, "buffer", None)
+    if buffer is None or not nbytes <= buffer.nbytes <= 2 * nbytes:
+        # drop the old buffer first, so both are never alive at once
+        del buffer
+        scratch.buffer = None
+        scratch.buffer = np.empty(nbytes, dtype=np.uint8)
+    return scratch.buffer[:nbytes].view(dtype).reshape(shape)
+
+
+def load_as_xarray(
+    path: str,
+    index: int,
+    tf: Optional[tifffile.TiffFile] = None,
+    planes: Optional[PlaneReader] = None,
+    dtype: Optional[np.dtype] = None,
+    region: Optional[Tuple[int, int, int, int]] = None,
+    out: Optional[np.ndarray] = None,
+    max_workers: int = READ_WORKERS,
+):
+    """Loads the series index of path as a ctzyx DataArray
+
+    Tiffs are loaded lazily from tf, which has to stay open (and is closed
+    by the caller) until the array was consumed. Without tf the tiff is
+    opened, read eagerly and closed again.
+    """
+    if is_tiff(path):
+        if tf is None:
+            with open_tiff(path) as tf:
+                return load_as_xarray(path, index, tf=tf, region=region).compute()
+
+        # reuse the caller's TiffFile, so the IFDs are only parsed once per file.
+        # For a region keep the strips or tiles of the file as chunks, so
+        # slicing only decodes the ones overlapping the region
+        image = tiff_as_ctzyx(
+            tf.series[index],
+            chunkmode=tifffile.CHUNKMODE.STRILE
+            if region
+            else tifffile.CHUNKMODE.PAGE,
+        )
+        logger.debug("shape: %s", image.shape)
+
+        if region:
+            check_region(region, image.shape[-1], image.shape[-2])
+            x, y, width, height = region
+            image = image[..., y : y + height, x : x + width]
         return xr.DataArray(image, dims=list("ctzyx"))
 
     else:
-        image = AICSImage(path)
-        image.set_scene(index)
-        image = image.xarray_data.rename({"C": "c", "T": "t", "Z": "z", "X": "x", "Y": "y"})
-        image.attrs = {}
-        return image
+        # the metadata is read through bioformats, so read the pixels with it
+        # as well to keep the series indices aligned. The buffer is already
+        # laid out as ctzyx, so from_xarray never has to transpose it. Reuse
+        # the caller's PlaneReader, so the file is only initialized once
+        with nullcontext(planes) if planes else PlaneReader(
+            path, max_workers=max_workers
+        ) as planes:
+            data = planes.read_series(index, dtype=dtype, region=region, out=out)
+        return xr.DataArray(data, dims=list("ctzyx"))
+
+
+def build_omero_input(
+    image: Image,
+    instrument_map: Dict[str, InstrumentFragment],
+    position: Optional[PositionFragment] = None,
+    timepoint: Optional[TimepointFragment] = None,
+) -> OmeroRepresentationInput:
+    """Builds the omero metadata of a series from its OME image"""
+    pixels = image.pixels
+
+    # the plane metadata was already validated by ome_types, so skip
+    # the (per field) pydantic validation for the potentially
+    # hundreds of thousands of planes
+    planes = [
+        PlaneInput.construct(
+            z=p.the_z,
+            c=p.the_c,
+            t=p.the_t,
+            exposureTime=p.exposure_time,
+            deltaT=p.delta_t,
+            positionX=p.position_x,
+            positionY=p.position_y,
+            positionZ=p.position_z,
+        )
+        for p in pixels.planes
+    ]
+
+    return OmeroRepresentationInput(
+        planes=planes,
+        timepoints=[timepoint] if timepoint else None,
+        positions=[position] if position else None,
+        acquisitionDate=image.acquisition_date,
+        physicalSize=PhysicalSizeInput(
+            x=pixels.physical_size_x,
+            y=pixels.physical_size_y,
+            z=pixels.physical_size_z,
+        ),
+        instrument=instrument_map.get(image.instrument_ref.id, None)
+        if image.instrument_ref
+        else None,
+        channels=[
+            ChannelInput(
+                name=c.name,
+                emmissionWavelength=c.emission_wavelength,
+                excitationWavelength=c.excitation_wavelength,
+                acquisitionMode=c.acquisition_mode.value
+                if c.acquisition_mode
+                else None,
+                color=c.color.as_rgb(),
+            )
+            for c in pixels.channels
+        ],
+        objectiveSettings=ObjectiveSettingsInput(
+            correctionCollar=image.objective_settings.correction_collar,
+            medium=str(image.objective_settings.medium.value).upper()
+            if image.objective_settings.medium
+            else None,
+        )
+        if image.objective_settings
+        else None,
+        imagingEnvironment=ImagingEnvironmentInput(
+            airPressure=image.imaging_environment.air_pressure,
+            co2Percent=image.imaging_environment.co2_percent,
+            humidity=image.imaging_environment.humidity,
+            temperature=image.imaging_environment.temperature,
+        )
+        if image.imaging_environment
+        else None,
+    )
 
 
 @register(
@@ -93,12 +518,13 @@ def convert_omero_file(
         List[RepresentationFragment]: The created series in this file
     """
 
-    images = []
-
     assert file.file, "No File Provided"
-    with file.file as f:
-        meta = bioformats_ome(f)
-        print(meta)
+    with file.file as f, ExitStack() as stack:
+        # tiffs are read through tifffile, everything else through bioformats
+        tf = stack.enter_context(open_tiff(f)) if is_tiff(f) else None
+        planes = None if tf else stack.enter_context(PlaneReader(f))
+        meta = planes.ome() if planes else read_ome(f)
+        logger.debug("meta: %r", meta)
         instrument_map = {}
 
         for instrument in meta.instruments:
@@ -118,120 +544,134 @@ def convert_omero_file(
                     else None,
                 )
 
-        for index, image in enumerate(meta.images):
+        # bioformats series are read into a buffer per series worker, which
+        # is reused by its next series of a similar size once the previous
+        # one is uploaded
+        scratch = threading.local()
+
+        def process_series(index: int, image: Image) -> RepresentationFragment:
             # we will create an image for every series here
             pixels = image.pixels
-            print(pixels)
+            logger.debug("pixels: %r", pixels)
 
             views = []
-            # read array (at the moment fake)
-            array = load_as_xarray(f, index)
-
-            position = None
-            timepoint = None
-
-            if stage and position_from_planes and len(pixels.planes) > 0:
-                first_plane = pixels.planes[0]
-                position = create_position(
-                    stage,
-                    x=first_plane.position_x or 0,
-                    y=first_plane.position_y or 0,
-                    z=1,
-                    tolerance=position_tolerance,
-                )
+            shape = (
+                pixels.size_c,
+                pixels.size_t,
+                pixels.size_z,
+                pixels.size_y,
+                pixels.size_x,
+            )
+            dtype = pixels_dtype(pixels)
+            # tiffs are read lazily, so they don't need a buffer
+            out = scratch_array(scratch, shape, dtype) if dtype and not tf else None
+            # read the pixels in the background, while the metadata objects
+            # are created on the server
+            reading = read_pool.submit(
+                load_as_xarray,
+                f,
+                index,
+                tf=tf,
+                planes=planes,
+                dtype=dtype,
+                out=out,
+            )
 
-            if era and timepoint_from_time and image.acquisition_date:
-                assert era.start, "Era needs to have a start"
-                first_plane = pixels.planes[0]
-                timepoint = create_timepoint(
-                    era,
-                    delta_t=(
-                        image.acquisition_date - era.start.replace(tzinfo=None)
-                    ).microseconds,
-                    tolerance=timepoint_tolerance,
-                )
-                print(timepoint)
-
-            if channels_from_channels:
-                for index, c in enumerate(pixels.channels):
-                    c = create_channel(
-                        name=c.name or f"Channel {index}",
-                        emission_wavelength=c.emission_wavelength,
-                        excitation_wavelength=c.excitation_wavelength,
-                        acquisition_mode=c.acquisition_mode.value
-                        if c.acquisition_mode
-                        else None,
-                        color=c.color.as_rgb() if c.color else None,
+            try:
+                position = None
+                timepoint = None
+
+                if stage and position_from_planes and len(pixels.planes) > 0:
+                    first_plane = pixels.planes[0]
+                    position = create_position(
+                        stage,
+                        x=first_plane.position_x or 0,
+                        y=first_plane.position_y or 0,
+                        z=1,
+                        tolerance=position_tolerance,
                     )
 
-                    views.append(
-                        RepresentationViewInput(cMin=index, cMax=index, channel=c)
+                if era and timepoint_from_time and image.acquisition_date:
+                    assert era.start, "Era needs to have a start"
+                    timepoint = create_timepoint(
+                        era,
+                        delta_t=(
+                            image.acquisition_date - era.start.replace(tzinfo=None)
+                        ).microseconds,
+                        tolerance=timepoint_tolerance,
                     )
-
-            rep = from_xarray(
-                array,
-                name=file.name + " - " + (image.name if image.name else f"({index})"),
-                datasets=[dataset] if dataset else file.datasets,
-                file_origins=[file],
-                tags=["converted"],
-                views=views,
-                omero=OmeroRepresentationInput(
-                    planes=[
-                        PlaneInput(
-                            z=p.the_z,
-                            c=p.the_c,
-                            t=p.the_t,
-                            exposureTime=p.exposure_time,
-                            deltaT=p.delta_t,
-                            positionX=p.position_x,
-                            positionY=p.position_y,
-                            positionZ=p.position_z,
-                        )
-                        for p in pixels.planes
-                    ],
-                    timepoints=[timepoint] if timepoint else None,
-                    positions=[position] if position else None,
-                    acquisitionDate=image.acquisition_date,
-                    physicalSize=PhysicalSizeInput(
-                        x=pixels.physical_size_x,
-                        y=pixels.physical_size_y,
-                        z=pixels.physical_size_z,
-                    ),
-                    instrument=instrument_map.get(image.instrument_ref.id, None)
-                    if image.instrument_ref
-                    else None,
-                    channels=[
-                        ChannelInput(
-                            name=c.name,
-                            emmissionWavelength=c.emission_wavelength,
-                            excitationWavelength=c.excitation_wavelength,
-                            acquisitionMode=c.acquisition_mode.value
+                    logger.debug("timepoint: %r", timepoint)
+
+                if channels_from_channels:
+                    for c_index, c in enumerate(pixels.channels):
+                        c = create_channel(
+                            name=c.name or f"Channel {c_index}",
+                            emission_wavelength=c.emission_wavelength,
+                            excitation_wavelength=c.excitation_wavelength,
+                            acquisition_mode=c.acquisition_mode.value
                             if c.acquisition_mode
                             else None,
-                            color=c.color.as_rgb(),
+                            color=c.color.as_rgb() if c.color else None,
                         )
-                        for c in pixels.channels
-                    ],
-                    objectiveSettings=ObjectiveSettingsInput(
-                        correctionCollar=image.objective_settings.correction_collar,
-                        medium=str(image.objective_settings.medium.value).upper()
-                        if image.objective_settings.medium
-                        else None,
-                    )
-                    if image.objective_settings
-                    else None,
-                    imagingEnvironment=ImagingEnvironmentInput(
-                        airPressure=image.imaging_environment.air_pressure,
-                        co2Percent=image.imaging_environment.co2_percent,
-                        humidity=image.imaging_environment.humidity,
-                        temperature=image.imaging_environment.temperature,
-                    )
-                    if image.imaging_environment
-                    else None,
-                ),
-            )
 
-            images.append(rep)
+                        views.append(
+                            RepresentationViewInput(
+                                cMin=c_index, cMax=c_index, channel=c
+                            )
+                        )
+
+                # built before waiting for the pixels, so it overlaps the read
+                omero = build_omero_input(
+                    image,
+                    instrument_map,
+                    position=position,
+                    timepoint=timepoint,
+                )
+
+                array = reading.result()
+                assert (
+                    array.shape == shape
+                ), f"Read array {array.shape} does not match the metadata of series {index}"
+
+                rep = from_xarray(
+                    array,
+                    name=file.name
+                    + " - "
+                    + (image.name if image.name else f"({index})"),
+                    datasets=[dataset] if dataset else file.datasets,
+                    file_origins=[file],
+                    tags=["converted"],
+                    views=views,
+                    omero=omero,
+                )
+
+                return rep
+            finally:
+                # the read writes into this thread's scratch buffer, which is
+                # handed to the next series once we return; never let that
+                # happen while the read is still running (e.g. when creating
+                # the metadata failed)
+                wait([reading])
+
+        # series are independent, so read and upload a few of them at once.
+        # Every task runs in a copy of the current context, so the arkitekt
+        # clients are available within the worker threads
+        with ThreadPoolExecutor(
+            max_workers=SERIES_WORKERS
+        ) as read_pool, ThreadPoolExecutor(max_workers=SERIES_WORKERS) as pool:
+            futures = [
+                pool.submit(contextvars.copy_context().run, process_series, *args)
+                for args in enumerate(meta.images)
+            ]
+            done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+            # stop at the first failing series, like a sequential conversion
+            # would, instead of creating all the remaining ones first
+            for future in pending:
+                future.cancel()
+            for future in done:
+                future.result()
+
+            images = [future.result() for future in futures]
 
     return images
 
@@ -252,16 +692,13 @@ def convert_tiff_file(
     Returns:
         List[RepresentationFragment]: The created series in this file
     """
-    print("images")
+    logger.debug("converting tiff file %s", file.name)
 
     images = []
 
     assert file.file, "No File Provided"
-    with file.file as f:
-        image = tifffile.imread(f)
-
-        image = image.reshape((1,) * (5 - image.ndim) + image.shape)
-        array = xr.DataArray(image, dims=list("ctzyx"))
+    with file.file as f, open_tiff(f) as tf:
+        array = xr.DataArray(tiff_as_ctzyx(tf.series[0]), dims=list("ctzyx"))
 
         images.append(
             from_xarray(
@@ -8,4 +8,5 @@ async def main():
         print(await x.fakts.aload(force_refresh=True))
 
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,6 +2,7 @@ import jpype
 import scyjava
 from aicsimageio.metadata.utils import bioformats_ome
 
-# cause dependency buildup
-meta = bioformats_ome("test.tiff")
-print(meta)
\ No newline at end of file
+if __name__ == "__main__":
+    # cause dependency buildup
+    meta = bioformats_ome("test.tiff")
+    print(meta)